@@ -115,4 +115,6 @@ if __name__ == "__main__":
 
     finally: # 一定要执行
         with open("work", "w") as f:
-            f.write("0")
\ No newline at end of file
+            f.write("0")
+        # 先释放单例锁再关闭连接，关闭出错也不会卡住后续任务
+        mgr.close()
\ No newline at end of file
@@ -25,6 +25,7 @@ def has_nfo_file(folder_path):
 def gen_nfo():
     folders = list_folders(save_path)
     data.batch_insert_bvids(folders, downloaded_path, "MissAV") # 多点脏数据也无所谓
+    scraper = Sracper(save_path, myproxy) # 所有番号共用一个scraper，复用连接
     for folder in folders:
         if folder == "thumb":
             continue
@@ -38,10 +39,10 @@ def gen_nfo():
         #     continue
 
         print(folder)
-        scraper = Sracper(save_path, myproxy)
         scraper.scrape(folder)
 
         time.sleep(5)
+    scraper.close()
 
 if __name__ == "__main__":
     data.initialize_db(downloaded_path, "MissAV")
@@ -3,14 +3,39 @@ import random
 from loguru import logger
 import os
 import platform
+import functools
+from pathlib import Path
+from dataclasses import fields, is_dataclass
+
+try:
+    import orjson
+except ImportError: # 未安装orjson时回退到标准库json
+    orjson = None
+
+def json_loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def json_dumps(obj, indent: int = 2) -> bytes:
+    '''序列化为utf-8编码的bytes，dataclass直接序列化，无需asdict'''
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    if is_dataclass(obj):
+        # 浅拷贝字段即可，json只需要读取，不必像asdict那样递归深拷贝
+        obj = {f.name: getattr(obj, f.name) for f in fields(obj)}
+    return json.dumps(obj, ensure_ascii=False, indent=indent).encode('utf-8')
 
 # 获取项目目录
 current_file_path = os.path.abspath(__file__)
 project_root = os.path.dirname(os.path.dirname(current_file_path))
 
 # 获取配置
-with open(project_root+'/cfg/configs.json', 'r', encoding='utf-8') as file:
-    configs = json.load(file)
+@functools.lru_cache(maxsize=1)
+def _load_cfg() -> dict:
+    return json_loads(Path(project_root+'/cfg/configs.json').read_bytes())
+
+configs = _load_cfg()
 logger.info(configs)
 
 # 初始化日志
@@ -18,8 +43,8 @@ logger.add(
     configs["LogPath"]+"/{time:YYYY-MM-DD}.log",
     rotation="00:00",            
     retention="7 days", 
-    enqueue=False,
-    level="DEBUG",
+    enqueue=True,                # 日志写盘放到后台线程，不阻塞下载/刮削
+    level="DEBUG",               # 文件日志保留DEBUG，用户反馈问题时需要完整日志
     format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}"
 )
 
@@ -37,11 +62,7 @@ sorted_downloaders = sorted(
     reverse=True  # 降序排序
 )
 print(sorted_downloaders)
-missAVDomain = ""
-for downloader in configs["Downloader"]:
-    if downloader["downloaderName"] == "MissAV":
-        missAVDomain = downloader["domain"]
-        break
+missAVDomain = next((d["domain"] for d in configs["Downloader"] if d["downloaderName"] == "MissAV"), "")
 logger.info(f"missav domain: {missAVDomain}")
 
 scraperDomain = random.choice(configs["ScraperDomain"])
@@ -49,8 +70,8 @@ logger.info(f"scraper domain: {scraperDomain}")
 
 
 # 初始化下载器
-download_tool = f"'{project_root}/tools/m3u8-Downloader-Go'"
-ffmpeg_tool = f"'ffmpeg'"
+download_tool = f"{project_root}/tools/m3u8-Downloader-Go"
+ffmpeg_tool = "ffmpeg"
 if platform.system() == 'Windows':
     print("platform: Windows")
     download_tool = rf"{project_root}\tools\m3u8-Downloader-Go.exe"
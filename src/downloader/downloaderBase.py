@@ -3,14 +3,17 @@ from abc import ABC, abstractmethod
 import json
 from loguru import logger
 import os
-from dataclasses import dataclass, asdict, field
+import sys
+import subprocess
+import asyncio
+from dataclasses import dataclass, field
 from typing import Optional, Tuple
 from pathlib import Path
 from ..comm import *
 from curl_cffi import requests
 
 # 下载信息，只保留最基础的信息。只需要填写avid，其他字段用于调试，选填
-@dataclass
+@dataclass(slots=True)
 class AVDownloadInfo:
     m3u8: str = ""
     title: str = ""
@@ -29,8 +32,7 @@ class AVDownloadInfo:
             path = Path(file_path) if isinstance(file_path, str) else file_path
             path.parent.mkdir(parents=True, exist_ok=True)
             
-            with path.open('w', encoding='utf-8') as f:
-                json.dump(asdict(self), f, ensure_ascii=False, indent=indent)
+            path.write_bytes(json_dumps(self, indent=indent))
             return True
         except (IOError, TypeError) as e:
             logger.error(f"JSON序列化失败: {str(e)}")
@@ -62,6 +64,42 @@ class Downloader(ABC):
             'https': proxy
         } if proxy else None
         self.timeout = timeout
+        # 复用同一个session，保持长连接和TLS会话
+        self.session = requests.Session(impersonate="chrome110", proxies=self.proxies, headers=headers, timeout=timeout)
+        # 并发请求用的异步session及其事件循环，首次使用时创建，跨调用复用
+        self._loop = None
+        self._async_session = None
+        # 视频CDN（如surrit播放列表）一直直连，不走配置的代理；首次使用时创建
+        self._cdn_session = None
+
+    def close(self):
+        self.session.close()
+        if self._cdn_session is not None:
+            self._cdn_session.close()
+            self._cdn_session = None
+        if self._async_session is not None:
+            self._loop.run_until_complete(self._async_session.close())
+            self._async_session = None
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+    def _run(self, coro):
+        '''在同一个事件循环上执行协程，异步session绑定在这个循环上才能跨调用复用'''
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def _get_async_session(self) -> requests.AsyncSession:
+        if self._async_session is None:
+            self._async_session = requests.AsyncSession(loop=self._loop, impersonate="chrome110", proxies=self.proxies,
+                                                        headers=headers, timeout=self.timeout)
+        return self._async_session
+
+    def _get_cdn_session(self) -> requests.Session:
+        if self._cdn_session is None:
+            self._cdn_session = requests.Session(impersonate="chrome110", timeout=self.timeout)
+        return self._cdn_session
     
     def setDomain(self, domain: str) -> bool:
         if domain:  
@@ -89,14 +127,15 @@ class Downloader(ABC):
     def downloadInfo(self, avid: str) -> Optional[AVDownloadInfo]:
         '''将元数据download_info.json序列化到到对应位置，同时返回AVDownloadInfo'''
         # 获取html
-        avid = avid.upper()
-        print(os.path.join(self.path, avid))
-        os.makedirs(os.path.join(self.path, avid), exist_ok=True)
+        avid = sys.intern(avid.upper())
+        base = os.path.join(self.path, avid)
+        print(base)
+        os.makedirs(base, exist_ok=True)
         html = self.getHTML(avid)
         if not html:
             logger.error("获取html失败")
             return None
-        with open(os.path.join(self.path, avid, avid+".html"), "w+", encoding='utf-8') as f:
+        with open(os.path.join(base, avid+".html"), "w+", encoding='utf-8') as f:
             f.write(html)
 
         # 从html中解析元数据，返回MissAVInfo结构体
@@ -106,42 +145,47 @@ class Downloader(ABC):
             return None
         
         info.avid = info.avid.upper() # 强制大写
-        info.to_json(os.path.join(self.path, avid, "download_info.json"))
+        info.to_json(os.path.join(base, "download_info.json"))
         logger.info("已保存到 download_info.json")
 
         return info
 
     
     def downloadM3u8(self, url: str, avid: str) -> bool:
-        """m3u8视频下载"""
-        os.makedirs(os.path.dirname(os.path.join(self.path, avid)), exist_ok=True)
+        """m3u8视频下载，目录已在downloadInfo中创建"""
+        base = os.path.join(self.path, avid)
+        ts_path = os.path.join(base, avid+'.ts')
+        mp4_path = os.path.join(base, avid+'.mp4')
+        command = [download_tool, '-u', url, '-o', ts_path, '-H', f'Referer:http://{self.domain}']
+        proxy_args = ['-p', self.proxy] if self.proxy else []
         try:
+            # 输出不重定向，webui依赖下载器的进度输出
             if isNeedVideoProxy and self.proxy:
                 logger.info("使用代理")
-                command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -p {self.proxy} -H Referer:http://{self.domain}"
+                first = command + proxy_args
             else:
                 logger.info("不使用代理")
-                command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -H Referer:http://{self.domain}"
-            logger.debug(command)
-            if os.system(command) != 0:
+                first = command
+            logger.debug(first)
+            if subprocess.run(first, check=False).returncode != 0:
                 # 难顶。。。使用代理下载失败，尝试不用代理；不用代理下载失败，尝试使用代理
                 if not isNeedVideoProxy and self.proxy:
                     logger.info("尝试使用代理")
-                    command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -p {self.proxy} -H Referer:http://{self.domain}"
+                    retry = command + proxy_args
                 else:
                     logger.info("尝试不使用代理")
-                    command = f"{download_tool} -u {url} -o {os.path.join(self.path, avid, avid+'.ts')} -H Referer:http://{self.domain}"
-                logger.debug(f"retry {command}")
-                if os.system(command) != 0:
+                    retry = command
+                logger.debug(f"retry {retry}")
+                if subprocess.run(retry, check=False).returncode != 0:
                     return False
             
             # 转mp4
-            convert = f"{ffmpeg_tool} -i {os.path.join(self.path, avid, avid+'.ts')} -c copy -f mp4 {os.path.join(self.path, avid, avid+'.mp4')}"
+            convert = [ffmpeg_tool, '-i', ts_path, '-c', 'copy', '-f', 'mp4', mp4_path]
             logger.debug(convert)
-            if os.system(convert) != 0:
-                return False
-            if os.system(f"rm {os.path.join(self.path, avid, avid+'.ts')}") != 0:
+            if subprocess.run(convert, check=False).returncode != 0:
                 return False
+            # m3u8-Downloader-Go只能输出到文件，无法直接管道给ffmpeg，转换完成后直接unlink中间文件
+            os.unlink(ts_path)
             return True
         except:
             return False
@@ -149,19 +193,38 @@ class Downloader(ABC):
     def _fetch_html(self, url: str, referer: str = "") -> Optional[str]:
         logger.debug(f"fetch url: {url}")
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(
-                url,
-                proxies=self.proxies,
-                headers=newHeader,
-                timeout=self.timeout,
-                impersonate="chrome110",  # 可选：chrome, chrome110, edge99, safari15_5
-            )
+            response = self.session.get(url, headers={"Referer": referer} if referer else None)
+            response.raise_for_status()
+            return response.text
+        except requests.exceptions.RequestException as e:
+            logger.error(f"请求失败: {str(e)}")
+            return None
+
+    def _fetch_first_html(self, urls) -> Optional[str]:
+        '''并发请求所有候选url，按urls中的优先级返回第一个成功的html'''
+        return self._run(self._async_fetch_first_html(urls))
+
+    async def _async_fetch_first_html(self, urls) -> Optional[str]:
+        session = self._get_async_session()
+        tasks = [asyncio.create_task(self._async_fetch_html(session, url)) for url in urls]
+        try:
+            # 按优先级依次等待，高优先级成功后取消剩余请求
+            for task in tasks:
+                content = await task
+                if content:
+                    return content
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _async_fetch_html(self, session: requests.AsyncSession, url: str) -> Optional[str]:
+        logger.debug(f"fetch url: {url}")
+        try:
+            response = await session.get(url)
             response.raise_for_status()
             return response.text
         except requests.exceptions.RequestException as e:
             logger.error(f"请求失败: {str(e)}")
             return None
-    
\ No newline at end of file
@@ -1,30 +1,33 @@
 from .downloaderBase import *
 import re
+import sys
 from typing import Optional, Tuple
 
+_UUID_RE = re.compile(r"m3u8\|([a-f0-9\|]+)\|com\|surrit\|https\|video")
+_OG_TITLE_RE = re.compile(r'<meta property="og:title" content="(.*?)"')
+_CODE_RE = re.compile(r'^([A-Z]+(?:-[A-Z]+)*-\d+)')
+_UUID_MARKER = "|com|surrit|https|video"
+_OG_TITLE_MARKER = '<meta property="og:title"'
+_STREAM_RE = re.compile(r'#EXT-X-STREAM-INF:BANDWIDTH=(\d+),.*?RESOLUTION=(\d+x\d+).*?\n(.*)')
+
 class MissAVDownloader(Downloader):
     def getDownloaderName(self) -> str:
         return "MissAV"
 
-    def getHTML(self, avid: str) -> Optional[str]:
-        '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
-        url = f'https://{self.domain}/cn/{avid}-uncensored-leak'.lower()
-        content = self._fetch_html(url)
-        if content: return content
-
-        url = f'https://{self.domain}/cn/{avid}-chinese-subtitle'.lower()
-        content = self._fetch_html(url)
-        if content: return content
-
-        url = f'https://{self.domain}/cn/{avid}'.lower()
-        content = self._fetch_html(url)
-        if content: return content
+    # 按顺序尝试的详情页路径
+    URL_PATHS = ("cn/{avid}-uncensored-leak", "cn/{avid}-chinese-subtitle", "cn/{avid}", "dm13/cn/{avid}")
 
-        url = f'https://{self.domain}/dm13/cn/{avid}'.lower()
-        content = self._fetch_html(url)
-        if content: return content
+    def setDomain(self, domain: str) -> bool:
+        if not super().setDomain(domain):
+            return False
+        # 域名确定后预先生成url模板，getHTML时只需填充avid
+        self._url_templates = tuple(f'https://{domain}/{path}'.lower() for path in self.URL_PATHS)
+        return True
 
-        return None
+    def getHTML(self, avid: str) -> Optional[str]:
+        '''需要实现的方法：根据avid，构造url并请求，获取html, 返回字符串'''
+        avid = avid.lower()
+        return self._fetch_first_html([template.format(avid=avid) for template in self._url_templates])
 
     def parseHTML(self, html: str) -> Optional[AVDownloadInfo]:
         '''需要实现的方法：根据html，解析出元数据，返回AVMetadata'''
@@ -54,8 +57,12 @@ class MissAVDownloader(Downloader):
     @staticmethod
     def _extract_uuid(html: str) -> Optional[str]:
         try:
-            if match := re.search(r"m3u8\|([a-f0-9\|]+)\|com\|surrit\|https\|video", html):
-                return "-".join(match.group(1).split("|")[::-1])
+            # 先用子串查找定位，正则只在标记前的一小段窗口内匹配
+            idx = html.find(_UUID_MARKER)
+            while idx >= 0:
+                if match := _UUID_RE.search(html, max(0, idx - 200), idx + len(_UUID_MARKER)):
+                    return "-".join(match.group(1).split("|")[::-1])
+                idx = html.find(_UUID_MARKER, idx + 1)
             return None
         except Exception as e:
             logger.error(f"UUID提取异常: {str(e)}")
@@ -65,12 +72,13 @@ class MissAVDownloader(Downloader):
     def _extract_metadata(html: str, metadata: AVDownloadInfo) -> bool:
         try:
             # 提取OG标签
-            og_title = re.search(r'<meta property="og:title" content="(.*?)"', html)
+            idx = html.find(_OG_TITLE_MARKER)
+            og_title = _OG_TITLE_RE.search(html, idx) if idx >= 0 else None
 
             if og_title: # 处理标题和番号
                 title_content = og_title.group(1)
-                if code_match := re.search(r'^([A-Z]+(?:-[A-Z]+)*-\d+)', title_content):
-                    metadata.avid = code_match.group(1)
+                if code_match := _CODE_RE.search(title_content):
+                    metadata.avid = sys.intern(code_match.group(1))
                     metadata.title = title_content.replace(metadata.avid, '').strip()
                 else:
                     metadata.title = title_content.strip()
@@ -81,19 +89,15 @@ class MissAVDownloader(Downloader):
 
         return True
     
-    @staticmethod
-    def _get_highest_quality_m3u8(playlist_url: str) -> Optional[Tuple[str, str]]:
+    def _get_highest_quality_m3u8(self, playlist_url: str) -> Optional[Tuple[str, str]]:
         try:
-            response = requests.get(playlist_url, timeout=10, impersonate="chrome110")
+            # 播放列表和原来一样直连，只是复用CDN连接
+            response = self._get_cdn_session().get(playlist_url, timeout=10)
             response.raise_for_status()
             playlist_content = response.text
             
             streams = []
-            pattern = re.compile(
-                r'#EXT-X-STREAM-INF:BANDWIDTH=(\d+),.*?RESOLUTION=(\d+x\d+).*?\n(.*)'
-            )
-            
-            for match in pattern.finditer(playlist_content):
+            for match in _STREAM_RE.finditer(playlist_content):
                 bandwidth = int(match.group(1))
                 resolution = match.group(2)
                 url = match.group(3).strip()
@@ -101,7 +105,7 @@ class MissAVDownloader(Downloader):
             
             # 按带宽降序排序
             streams.sort(reverse=True, key=lambda x: x[0])
-            logger.debug(streams)
+            logger.opt(lazy=True).debug("{}", lambda: streams)
             
             if streams:
                 # 返回最高质量的流
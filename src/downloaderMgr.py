@@ -29,3 +29,8 @@ class DownloaderMgr:
     
     def GetDownloader(self, downloaderName: str) -> Optional[Downloader]:
         return self.downloaders[downloaderName]
+
+    def close(self):
+        '''关闭所有下载器的session'''
+        for downloader in self.downloaders.values():
+            downloader.close()
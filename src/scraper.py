@@ -2,7 +2,7 @@
 import json
 from loguru import logger
 import os
-from dataclasses import dataclass, asdict, field
+from dataclasses import dataclass, field
 from typing import Optional, List, Dict
 from pathlib import Path
 from .comm import *
@@ -12,8 +12,18 @@ from datetime import datetime
 from urllib.parse import urljoin, urlparse
 import time
 import re
+import sys
+import asyncio
 from xml.etree import ElementTree as ET
-from xml.dom import minidom
+import lxml.html
+
+try:
+    import pyvips
+except (ImportError, OSError): # 没有libvips时使用Pillow裁剪
+    pyvips = None
+
+# javbus详情页的番号，取自<title>开头
+_AVID_RE = re.compile(r'^((\d|[A-Z])+-\d+)')
 
 def is_complete_url(url):
     try:
@@ -23,7 +33,7 @@ def is_complete_url(url):
         return False
 
 # 详细的元数据
-@dataclass
+@dataclass(slots=True)
 class AVMetadata:
     title: str = ""
     cover: str = ""
@@ -32,8 +42,8 @@ class AVMetadata:
     description: str = ""
     duration: str = ""
     release_date: str = ""
-    keywords = [],
-    fanarts = []
+    keywords: list = field(default_factory=list)
+    fanarts: list = field(default_factory=list)
 
     def __str__(self):
         # 格式化演员信息
@@ -66,8 +76,7 @@ class AVMetadata:
             path = Path(file_path) if isinstance(file_path, str) else file_path
             path.parent.mkdir(parents=True, exist_ok=True)
             
-            with path.open('w', encoding='utf-8') as f:
-                json.dump(asdict(self), f, ensure_ascii=False, indent=indent)
+            path.write_bytes(json_dumps(self, indent=indent))
             return True
         except (IOError, TypeError) as e:
             logger.error(f"JSON序列化失败: {str(e)}")
@@ -96,6 +105,32 @@ class Sracper:
         } if proxy else None
         self.timeout = timeout
         self.domain = scraperDomain
+        # 复用同一个session，保持长连接
+        self.session = requests.Session(impersonate="chrome110", proxies=self.proxies, headers=headers, timeout=timeout)
+        # 图片并发下载用的异步session及其事件循环，首次使用时创建，所有番号共用
+        self._loop = None
+        self._async_session = None
+
+    def close(self):
+        self.session.close()
+        if self._async_session is not None:
+            self._loop.run_until_complete(self._async_session.close())
+            self._async_session = None
+        if self._loop is not None:
+            self._loop.close()
+            self._loop = None
+
+    def _run(self, coro):
+        '''在同一个事件循环上执行协程，异步session绑定在这个循环上才能跨调用复用'''
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coro)
+
+    def _get_async_session(self) -> requests.AsyncSession:
+        if self._async_session is None:
+            self._async_session = requests.AsyncSession(loop=self._loop, impersonate="chrome110", proxies=self.proxies,
+                                                        headers=headers, timeout=self.timeout)
+        return self._async_session
 
     def scrape(self, avid: str) -> Optional[AVMetadata]:
         # 获取html
@@ -112,71 +147,86 @@ class Sracper:
             return None
         logger.info(f"parse metadata succ: \n{metadata}")
 
+        # 目录只创建一次，后续步骤直接复用
+        base = Path(self.path) / metadata.avid
+        base.mkdir(parents=True, exist_ok=True)
+        thumb_dir = Path(self.path) / "thumb"
+        thumb_dir.mkdir(exist_ok=True)
+
         # 下载图像
-        if not self.downloadIMG(metadata):
+        if not self.downloadIMG(metadata, base, thumb_dir):
             return None
         logger.info(f"download img succ")
 
         # 生成nfo
-        self.genNFO(metadata)
+        self.genNFO(metadata, base)
         logger.info(f"gennfo succ")
         return metadata
 
 
     def _extract(self, html: str) -> Optional[AVMetadata]:
+        # 空响应不是详情页，和缺字段一样按网址有误处理
+        if not html or not html.strip():
+            logger.error("您進入的網址有誤：页面为空")
+            return None
         try:
             metadata = AVMetadata()
-            # 0. 提取avid
-            pattern = r'<title>((\d|[A-Z])+-\d+)'
-            avid = re.search(pattern, html).group(1)
-            if not avid:
+            # 一次解析成DOM，再单次遍历收集所有字段
+            found = self._collect_fields(lxml.html.fromstring(html))
+            # 0. 提取avid，验证页/中间页的标题匹配不到番号，属于正常情况，不打堆栈
+            page_title = found["title"]
+            m = _AVID_RE.search(page_title)
+            if not m:
+                logger.error(f"您進入的網址有誤：标题中没有番号（{page_title[:50]}）")
                 return None
+            avid = sys.intern(m.group(1))
             logger.debug(avid)
             # 1. 提取标题
-            title_pattern = r'<title>(.*?) - JavBus</title>'
-            title = re.search(title_pattern, html).group(1)
+            if not page_title.endswith(" - JavBus"):
+                logger.error("您進入的網址有誤：标题不是 JavBus 详情页")
+                return None
+            title = page_title[:-len(" - JavBus")]
             if not title:
+                logger.error("您進入的網址有誤：缺少标题")
                 return None
             logger.debug(title)
             # 2. 提取封面图
-            cover_pattern = r'<a class="bigImage" href="([^"]+)"><img src="([^"]+)"'
-            cover = re.search(cover_pattern, html).group(1)
+            cover = found["cover"]
             if not cover:
+                logger.error("您進入的網址有誤：缺少封面")
                 return None
             logger.debug(cover)
             # 3. 提取描述
-            desc_pattern = r'<meta name="description" content="([^"]+)">'
-            desc = re.search(desc_pattern, html).group(1)
+            desc = found["description"]
             if not desc:
+                logger.error("您進入的網址有誤：缺少描述")
                 return None
             logger.debug(desc)
             # 4. 提取关键字
-            keywords_pattern = r'<meta name="keywords" content="([^"]+)">'
-            keywords = re.search(keywords_pattern, html).group(1).split(',')
+            # 先判断原始字符串，"".split(',') 会得到 ['']，无法据此判断缺失
+            raw_keywords = found["keywords"]
+            keywords = [k for k in raw_keywords.split(',') if k] if raw_keywords else []
             if not keywords:
+                logger.error("您進入的網址有誤：缺少关键字")
                 return None
             logger.debug(keywords)
             # 5. 提取发行日期
-            date_pattern = r'<span class="header">發行日期:</span> ([^<]+)'
-            date = re.search(date_pattern, html).group(1).strip()
+            date = sys.intern(found["發行日期:"].strip())
             if not date:
+                logger.error("您進入的網址有誤：缺少发行日期")
                 return None
             logger.debug(date)
             # 6. 提取时长
-            duration_pattern = r'<span class="header">長度:</span> ([^<]+)'
-            duration = re.search(duration_pattern, html).group(1).strip()
+            duration = found["長度:"].strip()
             if not duration:
+                logger.error("您進入的網址有誤：缺少时长")
                 return None
             logger.debug(duration)
             # 7. 提取演员及头像
-            actors_pattern = r'<a class="avatar-box" href="[^"]+">\s*<div class="photo-frame">\s*<img src="([^"]+)"[^>]+>\s*</div>\s*<span>([^<]+)</span>'
-            actresses = re.findall(actors_pattern, html)
-            logger.debug(actresses)
+            actresses = found["actresses"]
+            logger.opt(lazy=True).debug("{}", lambda: actresses)
             # 匹配样品图像
-            fanart_pattern = r'<a class="sample-box" href="(.*?\.jpg)">'
-            fanarts = re.findall(fanart_pattern, html)
-            if not fanarts:
-                fanarts = []
+            fanarts = found["fanarts"]
 
             metadata.avid = avid
             metadata.title = title
@@ -197,39 +247,69 @@ class Sracper:
 
             return metadata
         
-        except:
-            logger.error("您進入的網址有誤")
+        except (AttributeError, KeyError, ValueError, lxml.etree.ParserError):
+            # 字段缺失都在上面显式处理，走到这里说明解析逻辑本身出错，带上堆栈
+            logger.exception("解析javbus页面异常")
             return None
     
-    def downloadIMG(self, metadata: AVMetadata) -> bool:
-        '''海报+封面+演员头像'''
-        # 下载横版海报
-        prefix = metadata.avid+"-" # Jellyfin海报格式
-        fanartCount = 1
-        if self._download_file(metadata.cover, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"https://{self.domain}/{metadata.avid}"):
-            # 裁剪竖版封面
-            self._crop_img(metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", metadata.avid+"/"+prefix+"poster.jpg")
-        else:
-            logger.error(f"封面下载失败：{metadata.cover}")
-            return False
-        
-        # 下载预览图
-        for fanart in metadata.fanarts:
-            fanartCount += 1
-            self._download_file(fanart, metadata.avid+"/"+prefix+f"fanart-{fanartCount}.jpg", referer=f"https://{self.domain}/{metadata.avid}")
+    @staticmethod
+    def _collect_fields(tree) -> dict:
+        '''只遍历一次DOM，按标签分派到各字段，代替每个字段各自搜索整棵树'''
+        found = {"title": "", "cover": "", "description": "", "keywords": "",
+                  "發行日期:": "", "長度:": "", "actresses": [], "fanarts": []}
+        for el in tree.iter("title", "meta", "a", "span"):
+            tag = el.tag
+            if tag == "title":
+                found["title"] = found["title"] or (el.text or "")
+            elif tag == "meta":
+                name = el.get("name")
+                if name in ("description", "keywords") and not found[name]:
+                    found[name] = el.get("content") or ""
+            elif tag == "a":
+                cls = el.get("class")
+                if cls == "bigImage":
+                    found["cover"] = found["cover"] or (el.get("href") or "")
+                elif cls == "avatar-box":
+                    img = el.xpath('string(./div[@class="photo-frame"]/img/@src)')
+                    name = el.findtext("span")
+                    if img and name:
+                        found["actresses"].append((img, sys.intern(name)))
+                elif cls == "sample-box":
+                    href = el.get("href") or ""
+                    if href.endswith(".jpg"):
+                        found["fanarts"].append(href)
+            elif el.get("class") == "header" and el.text in ("發行日期:", "長度:"):
+                found[el.text] = found[el.text] or (el.tail or "")
+        return found
 
-        # 检查演员是否存在，不存在则下载图像
+    def downloadIMG(self, metadata: AVMetadata, base: Path, thumb_dir: Path) -> bool:
+        '''海报+封面+演员头像，base为番号目录，thumb_dir为演员头像目录'''
+        prefix = metadata.avid+"-" # Jellyfin海报格式
+        referer = f"https://{self.domain}/{metadata.avid}"
+        cover = base / f"{prefix}fanart-1.jpg"
+        # 横版海报，必须放在第一个
+        jobs = [(metadata.cover, cover)]
+        # 预览图
+        for fanartCount, fanart in enumerate(metadata.fanarts, start=2):
+            jobs.append((fanart, base / f"{prefix}fanart-{fanartCount}.jpg"))
+        # 检查演员是否存在，不存在则下载图像。一次scandir拿到已有头像，避免逐个stat
+        existing = {entry.name for entry in os.scandir(thumb_dir)} if thumb_dir.is_dir() else set()
         for av, url in metadata.actress.items():
             logger.debug(av)
-            # 判断是否已经存在
-            if os.path.exists(os.path.join(self.path, "thumb", av+".jpg")):
+            if f"{av}.jpg" in existing:
                 logger.info(f"av {av} already exist")
                 continue
-            else:
-                self._download_file(url, os.path.join(self.path, "thumb/"+av+".jpg"), referer=f"https://{self.domain}/{metadata.avid}")
+            jobs.append((url, thumb_dir / f"{av}.jpg"))
+
+        # 所有图片并发下载，封面失败时立即取消其余下载
+        if not self._run(self._download_images(jobs, referer)):
+            logger.error(f"封面下载失败：{metadata.cover}")
+            return False
+        # 裁剪竖版封面
+        self._crop_img(cover, base / f"{prefix}poster.jpg")
         return True
 
-    def genNFO(self, metadata: AVMetadata) -> bool:
+    def genNFO(self, metadata: AVMetadata, base: Path) -> bool:
         prefix = metadata.avid+"-" # Jellyfin海报格式
         # 创建XML根节点
         root = ET.Element("movie")
@@ -252,14 +332,13 @@ class Sracper:
             mins = metadata.duration.replace("分鐘", "").strip()
             ET.SubElement(root, "runtime").text = mins
         
-        # 海报
-        if metadata.cover:
+        # 海报和预览
+        if metadata.cover or metadata.fanarts:
             art = ET.SubElement(root, "art")
-            ET.SubElement(art, "poster").text = prefix+"poster.jpg"
-        
-        # 预览
-        for i in range(1, len(metadata.fanarts) + 1):
-            ET.SubElement(art, "fanart").text = prefix+f"fanart-{i}.jpg"
+            if metadata.cover:
+                ET.SubElement(art, "poster").text = f"{prefix}poster.jpg"
+            for i in range(1, len(metadata.fanarts) + 1):
+                ET.SubElement(art, "fanart").text = f"{prefix}fanart-{i}.jpg"
         
         # 演员信息
         for name, _ in metadata.actress.items():
@@ -271,30 +350,35 @@ class Sracper:
         for genre in metadata.keywords[:5]:  # 最多取5个关键词
             ET.SubElement(root, "genre").text = genre
 
-        # 转换为格式化的XML
-        xml_str = ET.tostring(root, encoding='utf-8')
-        dom = minidom.parseString(xml_str)
-        
-        # 写入文件
-        with open(os.path.join(self.path, metadata.avid, metadata.avid+".nfo"), 'w', encoding='utf-8') as f:
-            dom.writexml(f, indent="  ", addindent="  ", newl="\n", encoding='utf-8')
+        # 原地缩进后直接写入文件
+        ET.indent(root, space="  ")
+        ET.ElementTree(root).write(base / f"{metadata.avid}.nfo", encoding='utf-8', xml_declaration=True)
         return True
 
-    def _download_file(self, url: str, filename: str, referer: str = "") -> bool:
+    async def _download_images(self, jobs: List[tuple], referer: str = "") -> bool:
+        '''jobs: [(url, target)]，jobs[0]为封面；返回封面是否下载成功，其余图片失败不影响结果'''
+        session = self._get_async_session()
+        tasks = [asyncio.create_task(self._download_file(session, url, target, referer)) for url, target in jobs]
+        try:
+            if not await tasks[0]:
+                return False
+            await asyncio.gather(*tasks[1:])
+            return True
+        finally:
+            # 封面失败时取消还在下载的图片；正常结束时这里什么也不做
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _download_file(self, session: requests.AsyncSession, url: str, target: Path, referer: str = "") -> bool:
         """通用下载方法，下载到指定位置"""
-        logger.debug(f"download {url} to {os.path.join(self.path, filename)}")
+        logger.debug(f"download {url} to {target}")
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(url, stream=True, impersonate="chrome110", proxies=self.proxies,\
-                                    headers=newHeader,timeout=self.timeout, allow_redirects=False)
+            # 封面/头像都只有几百KB，整体读完后一次写入，省掉逐块循环
+            response = await session.get(url, headers={"Referer": referer} if referer else None,
+                                         allow_redirects=False)
             response.raise_for_status()
-            
-            with open(os.path.join(self.path, filename), 'wb') as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        f.write(chunk)
+            target.write_bytes(response.content)
             return True
         except Exception as e:
             logger.error(f"下载失败: {e}")
@@ -302,15 +386,9 @@ class Sracper:
     
     def _fetch_html(self, url: str, referer: str = "") -> Optional[str]:
         try:
-            newHeader = headers
-            if referer:
-                newHeader["Referer"] = referer
-            response = requests.get(
+            response = self.session.get(
                 url,
-                proxies=self.proxies,
-                headers=newHeader,
-                timeout=self.timeout,
-                impersonate="chrome110",  # 可选：chrome, chrome110, edge99, safari15_5
+                headers={"Referer": referer} if referer else None,
                 allow_redirects=False
             )
             response.raise_for_status()
@@ -319,18 +397,33 @@ class Sracper:
             logger.error(f"请求失败: {str(e)}")
             return None
     
-    def _crop_img(self, srcname, optname):
-        img = Image.open(os.path.join(self.path, srcname))
-        width, height = img.size
+    def _crop_img(self, src: Path, opt: Path):
+        if pyvips:
+            self._crop_img_vips(src, opt)
+            return
+        # Image.open只解析文件头拿尺寸，像素在crop时才解码，竖版封面不会触发解码
+        with Image.open(src) as img:
+            width, height = img.size
+            if height > width:
+                return
+            target_width = int(height * 565 / 800)
+            # 从右侧开始裁剪
+            left = width - target_width  # 右侧起点
+            right = width
+            top = 0
+            bottom = height
+            # 裁剪并保存
+            cropped_img = img.crop((left, top, right, bottom))
+            cropped_img.save(opt)
+        logger.debug(f"裁剪完成，尺寸: {cropped_img.size}")
+
+    def _crop_img_vips(self, src: Path, opt: Path):
+        '''libvips按需解码，只处理需要保留的右侧区域'''
+        img = pyvips.Image.new_from_file(str(src), access="sequential")
+        width, height = img.width, img.height
         if height > width:
             return
         target_width = int(height * 565 / 800)
         # 从右侧开始裁剪
-        left = width - target_width  # 右侧起点
-        right = width
-        top = 0
-        bottom = height
-        # 裁剪并保存
-        cropped_img = img.crop((left, top, right, bottom))
-        cropped_img.save(os.path.join(self.path, optname))
-        logger.debug(f"裁剪完成，尺寸: {cropped_img.size}")
+        img.extract_area(width - target_width, 0, target_width, height).write_to_file(str(opt))
+        logger.debug(f"裁剪完成，尺寸: {(target_width, height)}")
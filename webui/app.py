@@ -2,17 +2,26 @@ import os
 import re
 import json
 import time
+import asyncio
 import uuid
+import stat
 import shutil
+import signal
 import threading
-import subprocess
+import itertools
+from collections import deque
 from pathlib import Path
-from typing import Dict, Any, Optional, List
+from typing import Deque, Dict, Any, Optional, List, Tuple
 from fastapi import FastAPI, Form
 from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.middleware.cors import CORSMiddleware
 
+try:
+    import orjson
+except ImportError: # 未安装orjson时回退到标准库json
+    orjson = None
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 WEB_DIR = Path(__file__).resolve().parent
 STATIC_DIR = WEB_DIR / "static"
@@ -34,20 +43,72 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
 TASKS: Dict[str, Dict[str, Any]] = {}
-TASK_LOGS: Dict[str, List[Dict[str, Any]]] = {}
+MAX_LOG_LINES = 5000
+
+# 日志行存为 (ts, line) 元组，省去每行一个 dict
+TASK_LOGS: Dict[str, Deque[Tuple[float, str]]] = {}
+# 每个任务累计写入的日志行数，SSE 据此定位新增部分
+TASK_LOG_SEQ: Dict[str, int] = {}
+# 每个任务最近一次进度帧 (状态key, SSE 字节)，多个订阅者共用同一份序列化结果
+TASK_FRAMES: Dict[str, Tuple[Any, bytes]] = {}
+# 每个任务最近一次日志帧 (起始序号, 结束序号, SSE 字节)，进度一致的查看者直接复用
+TASK_LOG_FRAMES: Dict[str, Tuple[int, int, bytes]] = {}
 TASK_LOCK = threading.Lock()
 
-RUNNER_THREAD: Optional[threading.Thread] = None
-RUNNER_STOP = threading.Event()
+RUNNER_TASK: Optional[asyncio.Task] = None
+# 只在事件循环中使用，读输出时可以和 read 一起等待
+RUNNER_STOP = asyncio.Event()
 
-PENDING_QUEUE: List[str] = []
-QUEUE_COND = threading.Condition(TASK_LOCK)
+# 只在事件循环中读写，不需要锁
+PENDING_QUEUE: Deque[str] = deque()
 
 CURRENT_TASK_ID: Optional[str] = None
 
+# 正在运行的 main.py 子进程，按 task_id 记录；子进程各自独占一个进程组，停止时整组发信号
+RUNNING_PROCS: Dict[str, asyncio.subprocess.Process] = {}
+
+# 每个任务一个 Event，日志/状态变化时唤醒所有 SSE 订阅者
+TASK_EVENTS: Dict[str, asyncio.Event] = {}
+EVENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+# 结束超过 LOG_TTL 秒的任务释放日志，任务本身保留给历史记录
+LOG_TTL = 3600
+LOG_REAP_INTERVAL = 300
+LOG_REAPER: Optional[asyncio.Task] = None
+
+# 状态文件的内存副本，启动时加载一次，之后以它为准；由后台线程合并写盘
+_STATE_CACHE: Dict[str, Any] = {}
+_STATE_DIRTY = threading.Event()
+_STATE_WRITE_LOCK = threading.Lock()
+# 脏标记置位后再等这么久才写，期间的多次更新合并成一次写盘
+STATE_FLUSH_DELAY = 0.3
+_STATE_FLUSHER: Optional[threading.Thread] = None
+
 PERCENT_RE = re.compile(r"(\d{1,3})%")
 
-PRODUCT_EXTS = {".mp4", ".mkv", ".avi", ".mov", ".ts"}
+def _parse_percent(line: str) -> Optional[int]:
+    """取行尾 64 个字符内最后一个 'NN%' 的数值，'%' 前紧跟数字时不走正则"""
+    tail = max(0, len(line) - 64)
+    idx = line.rfind("%", tail)
+    if idx < 0:
+        return None
+    j = idx
+    lo = max(tail, idx - 3)
+    while j > lo and "0" <= line[j - 1] <= "9":
+        j -= 1
+    if j < idx:
+        return int(line[j:idx])
+    # 最后一个 '%' 前不是数字（如 "50% done%"），回退到正则找前面的
+    m = PERCENT_RE.search(line, tail)
+    return int(m.group(1)) if m else None
+
+# 元组：既可直接用于 str.endswith，同名探测也按固定顺序（mp4 优先）
+PRODUCT_EXTS = (".mp4", ".mkv", ".avi", ".mov", ".ts")
+
+# 禁止代理缓冲，保证 SSE 实时推送
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+# 空闲时的 SSE 注释心跳，浏览器会忽略，用于保活和发现断开的连接
+SSE_HEARTBEAT = b": ping\n\n"
 
 def _safe_unlink(p: Path) -> bool:
     try:
@@ -64,21 +125,27 @@ def _reset_webui_default_state(clear_download_db: bool = True):
     - 历史记录不带上一次下载
     - /db/downloaded.db 不带上一次下载
     """
-    global CURRENT_TASK_ID, RUNNER_THREAD
+    global CURRENT_TASK_ID, RUNNER_TASK
 
     RUNNER_STOP.clear()
     _force_work_flag("0")
 
-    with QUEUE_COND:
-        PENDING_QUEUE.clear()
+    PENDING_QUEUE.clear()
 
     with TASK_LOCK:
         TASKS.clear()
         TASK_LOGS.clear()
+        TASK_LOG_SEQ.clear()
+        TASK_FRAMES.clear()
+        TASK_LOG_FRAMES.clear()
+        TASK_EVENTS.clear()
         CURRENT_TASK_ID = None
 
     _safe_unlink(APP_STATE_PATH)
-    _update_app_state({"current_task_id": None, "tasks": {}, "plan": [], "plan_updated_at": _now_ts()})
+    with TASK_LOCK:
+        _STATE_CACHE.clear()
+    # tasks 仍指向已清空的 TASKS，保证内存副本始终引用同一个 dict
+    _update_app_state({"current_task_id": None, "tasks": TASKS, "plan": [], "plan_updated_at": _now_ts()})
 
     if clear_download_db:
         try:
@@ -88,42 +155,103 @@ def _reset_webui_default_state(clear_download_db: bool = True):
         _safe_unlink(DOWNLOAD_DB_PATH)
 
     try:
-        if RUNNER_THREAD is not None and (not RUNNER_THREAD.is_alive()):
-            RUNNER_THREAD = None
+        if RUNNER_TASK is not None and RUNNER_TASK.done():
+            RUNNER_TASK = None
     except Exception:
         pass
 
 def _now_ts() -> float:
     return time.time()
 
-def _append_log(task_id: str, line: str):
-    with TASK_LOCK:
-        TASK_LOGS.setdefault(task_id, []).append({"ts": _now_ts(), "line": line})
-        if len(TASK_LOGS[task_id]) > 5000:
-            TASK_LOGS[task_id] = TASK_LOGS[task_id][-5000:]
-
-def _update_app_state(patch: Dict[str, Any]):
-    """合并更新 /tmp/nassav_webui_state.json，避免覆盖其他字段（如 tasks/plan）"""
+def _wake_task(task_id: str):
+    """在事件循环线程中执行：唤醒当前 Event 上的所有等待者，下次等待换用新的 Event"""
+    ev = TASK_EVENTS.pop(task_id, None)
+    if ev is not None:
+        ev.set()
+
+def _notify_task(task_id: str):
+    """可在任意线程调用；在事件循环内直接唤醒，省掉 call_soon_threadsafe 的自管道写入"""
+    loop = EVENT_LOOP
+    if loop is None:
+        return
     try:
-        APP_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    except Exception:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        _wake_task(task_id)
+        return
+    try:
+        loop.call_soon_threadsafe(_wake_task, task_id)
+    except RuntimeError:
         pass
 
+def _task_event(task_id: str) -> asyncio.Event:
+    ev = TASK_EVENTS.get(task_id)
+    if ev is None:
+        ev = TASK_EVENTS[task_id] = asyncio.Event()
+    return ev
+
+async def _wait_task(ev: asyncio.Event, timeout: float = 15.0) -> bool:
+    """等待任务更新，超时返回 False"""
     try:
-        old: Dict[str, Any] = {}
+        await asyncio.wait_for(ev.wait(), timeout=timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+def _append_log(task_id: str, line: str, ts: Optional[float] = None):
+    # TASK_LOGS/TASK_LOG_SEQ 只在事件循环线程中读写，无需加锁
+    logs = TASK_LOGS.get(task_id)
+    if logs is None:
+        logs = TASK_LOGS[task_id] = deque(maxlen=MAX_LOG_LINES)
+    logs.append((_now_ts() if ts is None else ts, line))
+    TASK_LOG_SEQ[task_id] = TASK_LOG_SEQ.get(task_id, 0) + 1
+    _notify_task(task_id)
+
+def _append_logs(task_id: str, lines: List[str], ts: float):
+    """一块输出整体入队：只查一次 deque、只累加一次序号、只唤醒一次订阅者"""
+    logs = TASK_LOGS.get(task_id)
+    if logs is None:
+        logs = TASK_LOGS[task_id] = deque(maxlen=MAX_LOG_LINES)
+    n = 0
+    for line in lines:
+        if line:
+            logs.append((ts, line))
+            n += 1
+    if n:
+        TASK_LOG_SEQ[task_id] = TASK_LOG_SEQ.get(task_id, 0) + n
+        _notify_task(task_id)
+
+def _update_app_state(patch: Dict[str, Any]):
+    """合并更新 /tmp/nassav_webui_state.json，避免覆盖其他字段（如 tasks/plan）
+    只改内存副本并置脏标记，实际写盘由 _state_flusher 合并完成"""
+    with TASK_LOCK:
+        _STATE_CACHE.update(patch)
+    _STATE_DIRTY.set()
+
+def _flush_state_now():
+    """把内存副本写到临时文件再 os.replace，读者不会看到写了一半的文件"""
+    with _STATE_WRITE_LOCK:
         try:
-            if APP_STATE_PATH.exists():
-                old = json.loads(APP_STATE_PATH.read_text(encoding="utf-8")) or {}
+            with TASK_LOCK:
+                if orjson:
+                    data = orjson.dumps(_STATE_CACHE, option=orjson.OPT_NON_STR_KEYS)
+                else:
+                    data = json.dumps(_STATE_CACHE, ensure_ascii=False).encode("utf-8")
+            APP_STATE_PATH.parent.mkdir(parents=True, exist_ok=True)
+            tmp = APP_STATE_PATH.with_name(APP_STATE_PATH.name + ".tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, APP_STATE_PATH)
         except Exception:
-            old = {}
+            pass
 
-        if not isinstance(old, dict):
-            old = {}
-
-        old.update(patch)
-        APP_STATE_PATH.write_text(json.dumps(old, ensure_ascii=False), encoding="utf-8")
-    except Exception:
-        pass
+def _state_flusher():
+    while True:
+        _STATE_DIRTY.wait()
+        time.sleep(STATE_FLUSH_DELAY)
+        _STATE_DIRTY.clear()
+        _flush_state_now()
 
 def _persist_state():
     try:
@@ -139,26 +267,54 @@ def _load_state():
     global CURRENT_TASK_ID
     try:
         if APP_STATE_PATH.exists():
-            state = json.loads(APP_STATE_PATH.read_text(encoding="utf-8"))
+            raw = APP_STATE_PATH.read_bytes()
+            state = orjson.loads(raw) if orjson else json.loads(raw)
+            if isinstance(state, dict):
+                _STATE_CACHE.update(state)
             CURRENT_TASK_ID = state.get("current_task_id")
             tasks = state.get("tasks") or {}
             if isinstance(tasks, dict):
                 TASKS.update(tasks)
     except Exception:
         pass
+    # 内存副本直接引用 TASKS，写盘时总是最新的
+    _STATE_CACHE["tasks"] = TASKS
+
+def _transition(task_id: str, **fields):
+    """更新任务字段（自动刷新 updated_at）并持久化、唤醒订阅者"""
+    fields["updated_at"] = _now_ts()
+    with TASK_LOCK:
+        TASKS[task_id].update(fields)
+    _persist_task(task_id)
 
 def _persist_task(task_id: str):
-    _persist_state()
+    # _STATE_CACHE["tasks"] 就是 TASKS，current_task_id 由 _set_current_task 负责，置脏标记即可
+    _STATE_DIRTY.set()
+    t = TASKS.get(task_id)
+    # 任务进入终态时立即落盘，不等合并窗口
+    if t and t.get("status") in ("done", "error", "stopped"):
+        _flush_state_now()
+    _notify_task(task_id)
+
+CFG_PATH = BASE_DIR / "cfg" / "configs.json"
+
+# (configs.json 的 mtime_ns, SavePath)，配置未修改时不再重新解析
+_SAVE_PATH_CACHE: Optional[Tuple[int, str]] = None
 
 def _detect_save_path() -> str:
-    cfg_path = BASE_DIR / "cfg" / "configs.json"
+    global _SAVE_PATH_CACHE
     try:
-        cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+        mtime = CFG_PATH.stat().st_mtime_ns
+        cached = _SAVE_PATH_CACHE
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        cfg = json.loads(CFG_PATH.read_text(encoding="utf-8"))
         sp = cfg.get("SavePath") or "./MissAV"
         if sp.startswith("./"):
             sp = str((BASE_DIR / sp[2:]).resolve())
         elif not sp.startswith("/"):
             sp = str((BASE_DIR / sp).resolve())
+        _SAVE_PATH_CACHE = (mtime, sp)
         return sp
     except Exception:
         return str((BASE_DIR / "MissAV").resolve())
@@ -175,7 +331,8 @@ def _safe_remove_plate_dir(save_path: str, plate: str) -> bool:
     try:
         base = Path(save_path).resolve()
         target = (base / plate).resolve()
-        if base in target.parents and target.exists() and target.is_dir():
+        # rmtree 在 Linux 上已是基于 dir_fd + scandir 的实现，比手写 os.walk 少 stat 且防符号链接攻击
+        if base in target.parents and target.is_dir():
             shutil.rmtree(str(target), ignore_errors=True)
         return True
     except Exception:
@@ -183,22 +340,32 @@ def _safe_remove_plate_dir(save_path: str, plate: str) -> bool:
 
 def _guess_product_file(target_dir: Path, plate: str) -> Optional[Path]:
     """寻找下载完成后的成品文件"""
-    if not target_dir.exists():
-        return None
+    # 同名探测每个扩展名只 stat 一次（原先 exists/is_file/stat 各一次）
+    base = str(target_dir)
     for ext in PRODUCT_EXTS:
-        p = target_dir / f"{plate}{ext}"
-        if p.exists() and p.is_file() and p.stat().st_size > 0:
-            return p
-    candidates = []
-    for f in target_dir.iterdir():
-        if f.is_file() and f.suffix.lower() in PRODUCT_EXTS and f.stat().st_size > 0:
-            candidates.append(f)
-    if not candidates:
+        p = os.path.join(base, plate + ext)
+        try:
+            st = os.stat(p)
+        except OSError:
+            continue
+        if stat.S_ISREG(st.st_mode) and st.st_size > 0:
+            return Path(p)
+    # scandir 的 is_file 直接用 d_type，每个候选只 stat 一次，取最大的
+    best = None
+    best_size = 0
+    try:
+        with os.scandir(base) as it:
+            for e in it:
+                if not e.name.lower().endswith(PRODUCT_EXTS) or not e.is_file():
+                    continue
+                size = e.stat().st_size
+                if size > best_size:
+                    best, best_size = e.path, size
+    except FileNotFoundError:
         return None
-    candidates.sort(key=lambda x: x.stat().st_size, reverse=True)
-    return candidates[0]
+    return Path(best) if best else None
 
-def _maybe_cleanup_download_db(save_path: str, plate: str) -> bool:
+def _maybe_cleanup_download_db(target_dir: Path, plate: str) -> bool:
     """允许删除目录后重新下载
 
     先查 /db/downloaded.db 判断是否下载过
@@ -208,17 +375,34 @@ def _maybe_cleanup_download_db(save_path: str, plate: str) -> bool:
         if not DOWNLOAD_DB_PATH.exists():
             return False
 
-        target_dir = Path(save_path) / plate
-        product = _guess_product_file(target_dir, plate)
-        if (not target_dir.exists()) or (product is None):
+        # 目录不存在时 _guess_product_file 同样返回 None
+        if _guess_product_file(target_dir, plate) is None:
             _safe_unlink(DOWNLOAD_DB_PATH)
             return True
     except Exception:
         pass
     return False
 
-def _iter_sse_json(obj: Dict[str, Any]):
-    yield f"data: {json.dumps(obj, ensure_ascii=False)}\n\n"
+# 非默认参数的 json.dumps 每次都会新建 JSONEncoder，回退路径复用同一个
+_json_encode = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+def _sse_frame(obj: Any) -> bytes:
+    if orjson:
+        return b"data: " + orjson.dumps(obj) + b"\n\n"
+    return f"data: {_json_encode(obj)}\n\n".encode("utf-8")
+
+def _progress_frame(task_id: str, t: Dict[str, Any], key: Any) -> bytes:
+    """同一进度状态只序列化一次，只在事件循环中调用"""
+    cached = TASK_FRAMES.get(task_id)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    data = _sse_frame(t)
+    TASK_FRAMES[task_id] = (key, data)
+    return data
+
+def _parse_plates(raw: str) -> List[str]:
+    """逐行解析车牌号：去空白、转大写、保序去重（dict.fromkeys 在 C 层完成）"""
+    return list(dict.fromkeys(p for p in (x.strip().upper() for x in (raw or "").splitlines()) if p))
 
 def _task_init(task_id: str, plate: str):
     with TASK_LOCK:
@@ -231,7 +415,8 @@ def _task_init(task_id: str, plate: str):
             "created_at": _now_ts(),
             "updated_at": _now_ts(),
         }
-        TASK_LOGS[task_id] = []
+        TASK_LOGS[task_id] = deque(maxlen=MAX_LOG_LINES)
+        TASK_LOG_SEQ[task_id] = 0
     _persist_task(task_id)
 
 def _set_current_task(task_id: Optional[str]):
@@ -239,11 +424,55 @@ def _set_current_task(task_id: Optional[str]):
     CURRENT_TASK_ID = task_id
     _persist_state()
 
-def run_download(task_id: str, plate: str):
+def _signal_proc(proc: asyncio.subprocess.Process, sig: int):
+    """向子进程所在进程组发信号（start_new_session 后 pgid 即 pid）"""
+    # 已退出并回收的进程，其 pgid 可能被其他进程组复用，不能再发信号
+    if proc.returncode is not None:
+        return
+    try:
+        os.killpg(proc.pid, sig)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+async def _iter_output_chunks(stream: asyncio.StreamReader, stop: asyncio.Event):
+    """按块读取子进程输出，每次产出这一块里的完整行
+
+    下载器用 \r 刷新进度，按 \r / \n 切行（与 text 模式的 universal newlines 一致）。
+    每块只解码一次，到最后一个换行符为止，剩下的半行留在缓冲区。
+    """
+    buf = bytearray()
+    # 同时等待输出和停止请求：子进程没有输出时也能立即响应停止
+    stop_wait = asyncio.ensure_future(stop.wait())
+    try:
+        while True:
+            read = asyncio.ensure_future(stream.read(65536))
+            await asyncio.wait((read, stop_wait), return_when=asyncio.FIRST_COMPLETED)
+            if not read.done():
+                read.cancel()
+                return
+            chunk = read.result()
+            if not chunk:
+                break
+            buf += chunk
+            end = max(buf.rfind(b"\n"), buf.rfind(b"\r")) + 1
+            if not end:
+                continue
+            text = buf[:end].decode("utf-8", "replace")
+            del buf[:end]
+            yield text.splitlines()
+    finally:
+        stop_wait.cancel()
+    if buf:
+        yield [buf.decode("utf-8", "replace")]
+
+# main.py 的 stdout 接管道时默认块缓冲，强制无缓冲让日志及时到达；所有任务共用同一份环境
+CHILD_ENV = {**os.environ, "PYTHONUNBUFFERED": "1"}
+
+async def run_download(task_id: str, plate: str):
     save_path = _detect_save_path()
     target_dir = Path(save_path) / plate
 
-    cleaned_db = _maybe_cleanup_download_db(save_path, plate)
+    cleaned_db = _maybe_cleanup_download_db(target_dir, plate)
 
     _append_log(task_id, f"[INFO] SavePath：{save_path}")
     _append_log(task_id, f"[INFO] 目标目录：{target_dir}")
@@ -253,178 +482,190 @@ def run_download(task_id: str, plate: str):
 
     last_percent = 0
     saw_running_singleton_msg = False
+    # 进度只在百分比变化时发布，未变化时最多每秒刷新一次 updated_at
+    published_percent = None
+    last_publish = 0.0
 
     try:
         cmd = [str(BASE_DIR / "bin" / "python"), "main.py", plate]
-        proc = subprocess.Popen(
-            cmd,
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
             cwd=str(BASE_DIR),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+            env=CHILD_ENV,
+            # main.py 会再拉起 m3u8 下载器和 ffmpeg，放进独立进程组才能一并停止
+            start_new_session=True,
         )
 
-        with TASK_LOCK:
-            TASKS[task_id]["pid"] = proc.pid
-            TASKS[task_id]["updated_at"] = _now_ts()
-        _persist_task(task_id)
+        RUNNING_PROCS[task_id] = proc
+
+        _transition(task_id, pid=proc.pid)
 
         assert proc.stdout is not None
-        for raw in proc.stdout:
+        task = TASKS[task_id]
+        async for lines in _iter_output_chunks(proc.stdout, RUNNER_STOP):
             if RUNNER_STOP.is_set():
                 break
 
-            line = raw.rstrip("\n")
-            if not line:
-                continue
-
-            _append_log(task_id, line)
-
-            m = PERCENT_RE.search(line)
-            if m:
-                try:
-                    p = int(m.group(1))
-                    p = max(0, min(100, p))
-                    if p >= 1:
-                        last_percent = p
-                    with TASK_LOCK:
-                        TASKS[task_id].update(
-                            {"percent": p, "updated_at": _now_ts(), "status": "running"}
-                        )
-                    _persist_task(task_id)
-                except Exception:
-                    pass
-            else:
-                pass
-
-            if "A download task is running" in line or "download queue" in line:
-                saw_running_singleton_msg = True
+            # 同一块输出共用一个时间戳，整块一次入队、一次唤醒
+            _append_logs(task_id, lines, _now_ts())
+            if not saw_running_singleton_msg:
+                for line in lines:
+                    if "A download task is running" in line or "download queue" in line:
+                        saw_running_singleton_msg = True
+                        break
+
+            # 一块输出里只有最后一个进度有意义，从后往前找
+            p = None
+            for line in reversed(lines):
+                p = _parse_percent(line)
+                if p is not None:
+                    break
+            if p is not None:
+                p = max(0, min(100, p))
+                if p >= 1:
+                    last_percent = p
+                now = time.monotonic()
+                if p != published_percent or now - last_publish >= 1.0:
+                    published_percent = p
+                    last_publish = now
+                    # 只改已有的键，dict 大小不变，写盘线程序列化时也不会出错，不必加锁；
+                    # _STATE_CACHE 直接引用 TASKS，置脏标记即可
+                    task["percent"] = p
+                    task["status"] = "running"
+                    task["updated_at"] = _now_ts()
+                    _STATE_DIRTY.set()
+                    _notify_task(task_id)
 
         if RUNNER_STOP.is_set():
+            _signal_proc(proc, signal.SIGTERM)
+            # 等整组退出再删目录，避免下载器还在往里写；不肯退出的直接 SIGKILL
             try:
-                proc.terminate()
-            except Exception:
-                pass
+                await asyncio.wait_for(proc.wait(), timeout=3)
+            except asyncio.TimeoutError:
+                _signal_proc(proc, signal.SIGKILL)
+                await proc.wait()
 
             _force_work_flag("0")
-            removed = _safe_remove_plate_dir(save_path, plate)
+            removed = await asyncio.to_thread(_safe_remove_plate_dir, save_path, plate)
             _append_log(task_id, f"[INFO] 已停止，删除目录：{target_dir} -> {'OK' if removed else 'FAIL'}")
 
-            with TASK_LOCK:
-                TASKS[task_id].update(
-                    {"status": "stopped", "percent": last_percent, "message": "已停止", "updated_at": _now_ts()}
-                )
-            _persist_task(task_id)
+            _transition(task_id, status="stopped", percent=last_percent, message="已停止")
             return
 
-        code = proc.wait(timeout=10)
+        code = await asyncio.wait_for(proc.wait(), timeout=10)
 
         if saw_running_singleton_msg:
             _append_log(task_id, "[ERROR] main.py 仍检测到 work=1（单例锁异常），已强制写回 0，请重试。")
             _force_work_flag("0")
-            removed = _safe_remove_plate_dir(save_path, plate)
+            removed = await asyncio.to_thread(_safe_remove_plate_dir, save_path, plate)
             _append_log(task_id, f"[INFO] 删除目录：{target_dir} -> {'OK' if removed else 'FAIL'}")
-            with TASK_LOCK:
-                TASKS[task_id].update(
-                    {"status": "error", "percent": last_percent, "message": "失败（main.py 单例锁 work=1）", "updated_at": _now_ts()}
-                )
-            _persist_task(task_id)
+            _transition(task_id, status="error", percent=last_percent, message="失败（main.py 单例锁 work=1）")
             return
 
         product = _guess_product_file(target_dir, plate)
 
         if code == 0 and product:
-            with TASK_LOCK:
-                TASKS[task_id].update(
-                    {"status": "done", "percent": 100, "message": "完成", "updated_at": _now_ts(), "product": str(product)}
-                )
             _append_log(task_id, f"[INFO] 完成：{product.name}")
-            _persist_task(task_id)
+            _transition(task_id, status="done", percent=100, message="完成", product=str(product))
             return
         else:
             msg = f"失败（exit_code={code}，未识别到成品）"
             _append_log(task_id, f"[ERROR] {msg}")
-            removed = _safe_remove_plate_dir(save_path, plate)
+            removed = await asyncio.to_thread(_safe_remove_plate_dir, save_path, plate)
             _append_log(task_id, f"[INFO] 删除目录：{target_dir} -> {'OK' if removed else 'FAIL'}")
-            with TASK_LOCK:
-                TASKS[task_id].update(
-                    {"status": "error", "percent": last_percent, "message": msg, "updated_at": _now_ts()}
-                )
-            _persist_task(task_id)
+            _transition(task_id, status="error", percent=last_percent, message=msg)
             return
 
     except Exception as e:
-        with TASK_LOCK:
-            TASKS[task_id].update({"status": "error", "message": f"运行异常：{e}", "updated_at": _now_ts()})
         _append_log(task_id, f"[ERROR] 运行异常：{e}")
         try:
-            removed = _safe_remove_plate_dir(save_path, plate)
+            removed = await asyncio.to_thread(_safe_remove_plate_dir, save_path, plate)
             _append_log(task_id, f"[INFO] 删除目录：{target_dir} -> {'OK' if removed else 'FAIL'}")
         except Exception:
             pass
-        _persist_task(task_id)
+        # 最后再置终态：日志 SSE 看到终态就结束，之前的日志必须都已写入
+        _transition(task_id, status="error", message=f"运行异常：{e}")
+    finally:
+        RUNNING_PROCS.pop(task_id, None)
 
-def runner_loop():
+async def runner_loop():
     """按入队顺序逐个执行"""
-    global RUNNER_THREAD
+    global RUNNER_TASK
     try:
         while not RUNNER_STOP.is_set():
-            with QUEUE_COND:
-                if not PENDING_QUEUE:
-                    break
-                task_id = PENDING_QUEUE.pop(0)
+            if not PENDING_QUEUE:
+                break
+            task_id = PENDING_QUEUE.popleft()
 
-            with TASK_LOCK:
-                t = TASKS.get(task_id)
-                plate = (t.get("plate") if t else "") or ""
-                plate = plate.strip().upper()
-                if not t or not plate:
-                    continue
-                t.update({"status": "running", "updated_at": _now_ts()})
-            _persist_task(task_id)
+            t = TASKS.get(task_id)
+            # 车牌号在 _parse_plates 入口处已规范化
+            plate = (t.get("plate") if t else "") or ""
+            if not t or not plate:
+                continue
+            _transition(task_id, status="running")
 
             _set_current_task(task_id)
-            run_download(task_id, plate)
+            await run_download(task_id, plate)
 
         _set_current_task(None)
     finally:
         RUNNER_STOP.clear()
-        RUNNER_THREAD = None
+        RUNNER_TASK = None
         _persist_state()
 
+async def _reap_logs():
+    while True:
+        await asyncio.sleep(LOG_REAP_INTERVAL)
+        now = _now_ts()
+        with TASK_LOCK:
+            for tid, t in list(TASKS.items()):
+                if t.get("status") in ("done", "error", "stopped") and now - (t.get("updated_at") or 0) > LOG_TTL:
+                    TASK_LOGS.pop(tid, None)
+                    TASK_LOG_SEQ.pop(tid, None)
+                    TASK_EVENTS.pop(tid, None)
+                    TASK_FRAMES.pop(tid, None)
+                    TASK_LOG_FRAMES.pop(tid, None)
+
+@app.on_event("startup")
+async def _capture_loop():
+    global EVENT_LOOP, LOG_REAPER, _STATE_FLUSHER
+    EVENT_LOOP = asyncio.get_running_loop()
+    LOG_REAPER = asyncio.create_task(_reap_logs())
+    if _STATE_FLUSHER is None:
+        _STATE_FLUSHER = threading.Thread(target=_state_flusher, name="state-flusher", daemon=True)
+        _STATE_FLUSHER.start()
+
+@app.on_event("shutdown")
+def _flush_on_shutdown():
+    _flush_state_now()
+
+INDEX_PATH = STATIC_DIR / "index.html"
+# (index.html 的 mtime_ns, 内容)，文件修改后自动重新读取
+_INDEX_CACHE: Optional[Tuple[int, bytes]] = None
+
 @app.get("/", response_class=HTMLResponse)
 def index():
-    return (STATIC_DIR / "index.html").read_text(encoding="utf-8")
+    global _INDEX_CACHE
+    mtime = INDEX_PATH.stat().st_mtime_ns
+    cached = _INDEX_CACHE
+    if cached is None or cached[0] != mtime:
+        cached = _INDEX_CACHE = (mtime, INDEX_PATH.read_bytes())
+    return HTMLResponse(cached[1])
 
 @app.post("/api/plan")
-def api_plan(plates: str = Form(...)):
-    raw = plates or ""
-    lines = [x.strip().upper() for x in re.split(r"\r?\n", raw) if x.strip()]
-    seen = set()
-    out = []
-    for p in lines:
-        if p not in seen:
-            seen.add(p)
-            out.append(p)
+async def api_plan(plates: str = Form(...)):
+    out = _parse_plates(plates)
 
-    with TASK_LOCK:
-        _update_app_state({"plan": out, "plan_updated_at": _now_ts()})
+    _update_app_state({"plan": out, "plan_updated_at": _now_ts()})
 
     return JSONResponse({"ok": True, "count": len(out)})
 
 @app.post("/api/start")
-def api_start(plate: str = Form(...)):
-    global RUNNER_THREAD
-    raw = plate or ""
-    lines = [x.strip().upper() for x in re.split(r"\r?\n", raw) if x.strip()]
-    seen = set()
-    plates: List[str] = []
-    for p in lines:
-        if p not in seen:
-            seen.add(p)
-            plates.append(p)
+async def api_start(plate: str = Form(...)):
+    global RUNNER_TASK
+    plates = _parse_plates(plate)
 
     if not plates:
         return JSONResponse({"error": "empty"}, status_code=400)
@@ -432,16 +673,14 @@ def api_start(plate: str = Form(...)):
     is_batch = len(plates) > 1
 
     try:
+        # TASKS 的写入都在事件循环中，这里读取不必加锁
         busy = False
-        with TASK_LOCK:
-            if CURRENT_TASK_ID and CURRENT_TASK_ID in TASKS:
-                st = (TASKS[CURRENT_TASK_ID].get("status") or "").lower()
-                if st in ("running", "queued"):
-                    busy = True
-        with QUEUE_COND:
-            if PENDING_QUEUE:
-                busy = True
-        if RUNNER_THREAD is not None and RUNNER_THREAD.is_alive():
+        cur = TASKS.get(CURRENT_TASK_ID) if CURRENT_TASK_ID else None
+        if cur and (cur.get("status") or "").lower() in ("running", "queued"):
+            busy = True
+        if PENDING_QUEUE:
+            busy = True
+        if RUNNER_TASK is not None and not RUNNER_TASK.done():
             busy = True
         if busy:
             return JSONResponse({"error": "busy"}, status_code=409)
@@ -449,46 +688,39 @@ def api_start(plate: str = Form(...)):
         pass
 
     if not is_batch:
+        # 重置时已把 plan 清空，不必再写一次
         _reset_webui_default_state(clear_download_db=True)
-        _update_app_state({"plan": [], "plan_updated_at": _now_ts()})
     else:
         _update_app_state({"plan": plates, "plan_updated_at": _now_ts()})
 
-    task_ids: List[str] = []
-    first_task_id: Optional[str] = None
-    for p in plates:
-        tid = uuid.uuid4().hex
+    task_ids = [uuid.uuid4().hex for _ in plates]
+    for tid, p in zip(task_ids, plates):
         _task_init(tid, p)
-        task_ids.append(tid)
-        if first_task_id is None:
-            first_task_id = tid
 
-    with QUEUE_COND:
-        PENDING_QUEUE.extend(task_ids)
+    PENDING_QUEUE.extend(task_ids)
 
-    if RUNNER_THREAD is None or not RUNNER_THREAD.is_alive():
+    if RUNNER_TASK is None or RUNNER_TASK.done():
         RUNNER_STOP.clear()
-        RUNNER_THREAD = threading.Thread(target=runner_loop, daemon=True)
-        RUNNER_THREAD.start()
+        RUNNER_TASK = asyncio.create_task(runner_loop())
 
-    return JSONResponse({"task_id": first_task_id, "count": len(plates), "batch": is_batch})
+    return JSONResponse({"task_id": task_ids[0], "count": len(plates), "batch": is_batch})
 
 @app.post("/api/stop")
-def api_stop():
+async def api_stop():
     """
     停止当前下载，并清空“等待中”的列表：
     - 清空内存队列 PENDING_QUEUE
     - 清空 state.json 中的 plan
     - 将尚未开始的 queued 任务标记为 stopped
     """
+    global PENDING_QUEUE
     RUNNER_STOP.set()
 
     _force_work_flag("0")
 
     try:
-        with QUEUE_COND:
-            pending_ids = list(PENDING_QUEUE)
-            PENDING_QUEUE.clear()
+        # 直接换成空队列，不用先复制再清空
+        pending_ids, PENDING_QUEUE = PENDING_QUEUE, deque()
 
         with TASK_LOCK:
             for tid in pending_ids:
@@ -502,117 +734,132 @@ def api_stop():
                         }
                     )
         _persist_state()
+        for tid in pending_ids:
+            _notify_task(tid)
     except Exception:
         pass
 
-    try:
-        if CURRENT_TASK_ID and CURRENT_TASK_ID in TASKS:
-            pid = TASKS[CURRENT_TASK_ID].get("pid")
-            if pid:
-                try:
-                    os.kill(int(pid), 15)
-                except Exception:
-                    pass
-    except Exception:
-        pass
+    for proc in list(RUNNING_PROCS.values()):
+        _signal_proc(proc, signal.SIGTERM)
 
-    with TASK_LOCK:
-        _update_app_state({"plan": [], "plan_updated_at": _now_ts()})
+    _update_app_state({"plan": [], "plan_updated_at": _now_ts()})
 
     return JSONResponse({"ok": True})
 
 @app.get("/api/status")
-def api_status():
+async def api_status():
     """恢复当前正在运行的任务状态"""
-    with TASK_LOCK:
-        tid = CURRENT_TASK_ID
-        if not tid or tid not in TASKS:
-            return JSONResponse({"running": False})
-        t = TASKS[tid].copy()
-    return JSONResponse({"running": True, "task_id": tid, **t})
+    # 只读内存且运行在事件循环中，TASKS 的写入也都在事件循环中，读取不必加锁
+    tid = CURRENT_TASK_ID
+    if not tid or tid not in TASKS:
+        return JSONResponse({"running": False})
+    return JSONResponse({"running": True, "task_id": tid, **TASKS[tid]})
 
 @app.get("/api/history")
-def api_history():
+async def api_history():
     """提供历史：done/waiting/error"""
-    with TASK_LOCK:
-        plan = []
-        try:
-            if APP_STATE_PATH.exists():
-                old = json.loads(APP_STATE_PATH.read_text(encoding="utf-8"))
-                plan = old.get("plan") or []
-        except Exception:
-            plan = []
-
-        done = []
-        error = []
-        running_plate = None
-
-        for tid, t in TASKS.items():
-            st = t.get("status")
-            p = (t.get("plate") or "").upper()
-            if st == "done":
-                done.append(p)
-            elif st == "error":
-                error.append(p)
-            elif st == "running":
-                running_plate = p
-
-        done_set = set(done)
-        err_set = set(error)
-        waiting = []
-        for p in [x.upper() for x in plan]:
-            if p and (p not in done_set) and (p not in err_set) and (p != running_plate):
-                waiting.append(p)
+    # 与 api_status 相同，事件循环内读取内存不必加锁
+    # plan 直接取内存副本，不再每次读取解析状态文件
+    plan = _STATE_CACHE.get("plan") or []
+
+    done = []
+    error = []
+    running_plate = None
+
+    for tid, t in TASKS.items():
+        st = t.get("status")
+        p = t.get("plate") or ""
+        if st == "done":
+            done.append(p)
+        elif st == "error":
+            error.append(p)
+        elif st == "running":
+            running_plate = p
+
+    done_set = set(done)
+    err_set = set(error)
+    waiting = []
+    for p in plan:
+        if p and (p not in done_set) and (p not in err_set) and (p != running_plate):
+            waiting.append(p)
 
     return JSONResponse({"done": done, "waiting": waiting, "error": error})
 
 @app.get("/api/progress/{task_id}")
-def api_progress(task_id: str):
-    with TASK_LOCK:
-        t = TASKS.get(task_id)
-        if not t:
-            return JSONResponse({"error": "notfound"}, status_code=404)
-        return JSONResponse(t)
+async def api_progress(task_id: str):
+    t = TASKS.get(task_id)
+    if not t:
+        return JSONResponse({"error": "notfound"}, status_code=404)
+    return JSONResponse(t)
 
 @app.get("/api/progress/{task_id}/stream")
-def api_progress_stream(task_id: str):
-    def gen():
+async def api_progress_stream(task_id: str):
+    async def gen():
+        last_key = None
         while True:
-            with TASK_LOCK:
-                t = TASKS.get(task_id)
+            # TASKS 的写入都在事件循环中，读取不必加锁
+            t = TASKS.get(task_id)
+            # 未知任务直接返回，不为它创建 Event，免得 TASK_EVENTS 里堆积无人清理的条目
             if not t:
-                yield from _iter_sse_json({"task_id": task_id, "status": "error", "percent": 0})
+                yield _sse_frame({"task_id": task_id, "status": "error", "percent": 0})
                 return
-            yield from _iter_sse_json(t)
-            if t.get("status") in ("done", "error", "stopped"):
+            # 唤醒也在事件循环中执行，读状态和取 Event 之间没有 await，不会漏掉更新
+            ev = _task_event(task_id)
+            # 日志追加也会唤醒，进度没变就不再推送
+            key = (t.get("status"), t.get("percent"), t.get("message"), t.get("updated_at"))
+            data = _progress_frame(task_id, t, key) if key != last_key else None
+            if data is not None:
+                last_key = key
+                yield data
+            if key[0] in ("done", "error", "stopped"):
                 return
-            time.sleep(0.5)
+            if not await _wait_task(ev):
+                yield SSE_HEARTBEAT
 
-    return StreamingResponse(gen(), media_type="text/event-stream")
+    return StreamingResponse(gen(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @app.get("/api/logs/{task_id}/stream")
-def api_logs_stream(task_id: str):
-    def gen():
-        idx = 0
+async def api_logs_stream(task_id: str):
+    def take_new(sent: int):
+        logs = TASK_LOGS.get(task_id)
+        seq = TASK_LOG_SEQ.get(task_id, 0)
+        if not logs or seq <= sent:
+            return [], seq
+        # 新增的行都在右端，从尾部反向取只需 O(新增)；超出 MAX_LOG_LINES 被挤掉的行直接跳过
+        new = list(itertools.islice(reversed(logs), min(len(logs), seq - sent)))
+        new.reverse()
+        return new, seq
+
+    def frame(start: int, end: int, new) -> bytes:
+        # 同一区间的日志只序列化一次，多个查看者共用
+        cached = TASK_LOG_FRAMES.get(task_id)
+        if cached is not None and cached[0] == start and cached[1] == end:
+            return cached[2]
+        data = _sse_frame([{"ts": ts, "line": line} for ts, line in new])
+        TASK_LOG_FRAMES[task_id] = (start, end, data)
+        return data
+
+    async def gen():
+        sent = 0
         while True:
-            with TASK_LOCK:
-                logs = TASK_LOGS.get(task_id, [])
-                t = TASKS.get(task_id)
-            if idx < len(logs):
-                for j in range(idx, len(logs)):
-                    yield f"data: {json.dumps(logs[j], ensure_ascii=False)}\n\n"
-                idx = len(logs)
-
-            if t and t.get("status") in ("done", "error", "stopped"):
-                with TASK_LOCK:
-                    logs2 = TASK_LOGS.get(task_id, [])
-                if idx < len(logs2):
-                    for j in range(idx, len(logs2)):
-                        yield f"data: {json.dumps(logs2[j], ensure_ascii=False)}\n\n"
+            t = TASKS.get(task_id)
+            # 未知任务（或已被重置清掉的任务）不会再有日志，直接结束，也不为它创建 Event
+            if not t:
+                return
+            ev = _task_event(task_id)
+            start = sent
+            new, sent = take_new(sent)
+            # 一次唤醒新增的行合并成一帧（JSON 数组）发送
+            if new:
+                yield frame(start, sent, new)
+
+            # 取日志和读状态之间没有 await，终态前写入的日志已在上面发出，无需再取一次
+            if t.get("status") in ("done", "error", "stopped"):
                 return
 
-            time.sleep(0.35)
+            if not await _wait_task(ev):
+                yield SSE_HEARTBEAT
 
-    return StreamingResponse(gen(), media_type="text/event-stream")
+    return StreamingResponse(gen(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 _load_state()